@@ -157,12 +157,15 @@ class PPOTrainer:
 
             # compute metrics
             # NOTE: this metric is not accumulated globally so it will differ between DP ranks
+            # NOTE: keep the running sum on device, calling .item() here would force a sync per rollout batch
             ppo_rollout_metrics["init_policy_kl"] += (
-                masked_mean(init_policy_kl, mask, dim=-1).sum().item() if self.compute_init_policy_kl else 0
+                masked_mean(init_policy_kl, mask, dim=-1).sum() if self.compute_init_policy_kl else 0
             )
 
         # average across the samples for the non global metrics
-        ppo_rollout_metrics = {k: v / num_samples for k, v in ppo_rollout_metrics.items()}
+        ppo_rollout_metrics = {
+            k: (v.item() if torch.is_tensor(v) else v) / num_samples for k, v in ppo_rollout_metrics.items()
+        }
 
         for k in ppo_rollout_data:
             rollout_batch_seq_length = self.rollout_batch_seq_length
@@ -185,19 +185,25 @@ class MegatronGPTActorModel(NLPAdapterModelMixin, MegatronGPTModel, AlignableGen
             micro_batch_size=self.cfg.micro_batch_size,
         )
 
-        metrics = {}
-
-        for key in ["loss", "ppo_ratio", "ppo_ratio_clamped", "scaled_entropy"]:
-            if losses_reduced_per_micro_batch:
-                metric_mean = torch.stack(
-                    [loss_reduced[key] for loss_reduced in losses_reduced_per_micro_batch]
-                ).mean()
-            else:
-                metric_mean = torch.tensor(0.0, device=torch.cuda.current_device())
+        metric_keys = ["loss", "ppo_ratio", "ppo_ratio_clamped", "scaled_entropy"]
+
+        if losses_reduced_per_micro_batch:
+            # the per-key means can come back in mixed precision (e.g. half-precision
+            # ratios/entropy next to an fp32 loss), so cast each one to fp32 to keep the
+            # packed tensor homogeneous and matching the fp32 fallback below
+            metric_means = torch.stack(
+                [
+                    torch.stack([loss_reduced[key] for loss_reduced in losses_reduced_per_micro_batch]).mean().float()
+                    for key in metric_keys
+                ]
+            )
+        else:
+            metric_means = torch.zeros(len(metric_keys), device=torch.cuda.current_device())
 
-            torch.distributed.broadcast(metric_mean, get_last_rank())
+        # pack the scalars into one tensor so we pay for a single broadcast instead of one per metric
+        torch.distributed.broadcast(metric_means, get_last_rank())
 
-            metrics[key] = metric_mean.cpu().item()
+        metrics = dict(zip(metric_keys, metric_means.tolist()))
 
         return metrics["loss"], metrics
 
@@ -280,7 +286,11 @@ class MegatronGPTActorModel(NLPAdapterModelMixin, MegatronGPTModel, AlignableGen
         response_lengths = strategy.get_lengths()
         max_response_length = response_lengths.max().item()
 
-        response_tokens = torch.cuda.LongTensor(actor_output["token_ids"]) if actor_output else None
+        response_tokens = (
+            torch.as_tensor(actor_output["token_ids"], dtype=torch.long, device=torch.cuda.current_device())
+            if actor_output
+            else None
+        )
         response_tokens = broadcast_2d_tensor_within_pp(response_tokens, dtype=torch.long)
 
         # Sanity check to validate response length.
@@ -24,4 +24,4 @@ class ServerSignal(IntEnum):
     SAVE = auto()
 
     def cuda(self):
-        return torch.cuda.LongTensor([self])
+        return torch.as_tensor([self], dtype=torch.int64, device=torch.cuda.current_device())
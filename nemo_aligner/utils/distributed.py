@@ -65,7 +65,7 @@ def broadcast_2d_tensor(tensor, src, group, dtype=torch.float32):
             tensor.size(0),
             tensor.size(1),
         ]
-        input_info_tensor = torch.cuda.FloatTensor(input_info)
+        input_info_tensor = torch.tensor(input_info, dtype=torch.float32, device=torch.cuda.current_device())
 
         torch.distributed.broadcast(input_info_tensor, src, group)
         torch.distributed.broadcast(tensor, src, group)
@@ -230,23 +230,26 @@ class DistributedLogprob(torch.autograd.Function):
 
         # Create a mask of valid vocab ids (1 means it needs to be masked).
         target_mask = (target < vocab_start_index) | (target >= vocab_end_index)
-        masked_target = target - vocab_start_index
-        masked_target[target_mask] = 0
+        masked_target = (target - vocab_start_index).masked_fill_(target_mask, 0)
 
         # higher stability uses a more numerically stable distributed log_softmax instead of softmax
         # however, it uses more VRAM because there is an unavoidable exp() OP on the entire logits tensor
         # some models (like DPO) will get -inf in the resulting logprobs unless you set higher_stability=True
         if higher_stability:
-            log_softmax_output = _compute_distributed_log_softmax(vocab_parallel_logits)
-            log_probs = log_softmax_output.clone()
-            softmax_output = log_softmax_output.exp_()
+            log_probs = _compute_distributed_log_softmax(vocab_parallel_logits)
+            if inference_only:
+                # the softmax is only needed for backward, so skip the extra
+                # full-vocab exp() pass (and its allocation) at inference time
+                softmax_output = None
+            else:
+                softmax_output = log_probs.exp()
         else:
             softmax_output = _compute_distributed_softmax(vocab_parallel_logits)
             # if we only do inference, then do the log in place
             log_probs = softmax_output.log_() if inference_only else softmax_output.log()
 
         log_probs = torch.gather(log_probs, -1, masked_target.unsqueeze(-1)).squeeze(-1)
-        log_probs[target_mask] = 0.0
+        log_probs.masked_fill_(target_mask, 0.0)
 
         torch.distributed.all_reduce(
             log_probs, op=torch.distributed.ReduceOp.SUM, group=parallel_state.get_tensor_model_parallel_group(),
@@ -279,7 +282,9 @@ class DistributedLogprob(torch.autograd.Function):
 def calculate_distributed_entropy(vocab_parallel_logits, mask=None):
     # TODO(geshen): this is memory intensive
     logits = tensor_parallel.gather_from_tensor_model_parallel_region(vocab_parallel_logits)
-    full_log_probs = torch.nn.functional.log_softmax(logits, dim=2)[:, :-1, :].contiguous()
+    # NOTE: the entropy below is elementwise, so we can feed it the sliced view directly
+    # instead of paying for a full B x S x V copy with .contiguous()
+    full_log_probs = torch.nn.functional.log_softmax(logits, dim=2)[:, :-1, :]
 
     return calculate_entropy(full_log_probs, mask)
 
@@ -80,10 +80,8 @@ def create_mask(values, prompt_lengths, response_lengths):
     """Creates a mask to only keep the values in the sequence that are between prompt_lengths and sentence_lengths.
     This results in removing the prompt tokens, and removing the padding at the end of the sequence.
     """
-    mask = torch.zeros_like(values)
-
-    for i in range(mask.size(0)):
-        # Do prompt_length - 1 to remove the first log prob. But keep sentence_length
-        # as it is because we want to include one EOS token.
-        mask[i, prompt_lengths[i] - 1 : response_lengths[i] - 1] = 1.0
-    return mask
+    # Do prompt_length - 1 to remove the first log prob. But keep sentence_length
+    # as it is because we want to include one EOS token.
+    position_ids = torch.arange(values.size(-1), device=values.device).unsqueeze(0)
+    mask = (position_ids >= (prompt_lengths - 1).unsqueeze(-1)) & (position_ids < (response_lengths - 1).unsqueeze(-1))
+    return mask.to(values.dtype)
@@ -14,16 +14,35 @@
 
 """Utilities for generating text."""
 
+import copy
+import functools
+import itertools
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, List
 
+import numpy as np
 import torch
 from megatron.core import parallel_state
 
-from nemo.collections.nlp.modules.common.lm_utils import pad_batch
+from nemo.collections.common.tokenizers.huggingface.auto_tokenizer import AutoTokenizer
 from nemo.collections.nlp.modules.common.text_generation_strategy import GPTModelTextGenerationStrategy
+from nemo.utils import logging
 from nemo_aligner.utils.distributed import broadcast_2d_tensor_within_pp
 
+try:
+    from numba import njit, prange
+
+    HAVE_NUMBA = True
+except (ImportError, ModuleNotFoundError):
+    HAVE_NUMBA = False
+
+# generation allocates many short-lived tensors per decode step, which the
+# expandable-segments allocator handles with far less fragmentation (and fewer
+# fragmentation-driven OOMs on long rollouts); respect any user-provided setting
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
 
 class TrackLengthGPTModelTextGenerationStrategy(GPTModelTextGenerationStrategy):
     """
@@ -32,29 +51,75 @@ class TrackLengthGPTModelTextGenerationStrategy(GPTModelTextGenerationStrategy):
     TODO This is a temporary workaround until NeMo's `generate()` function returns this information.
     """
 
+    # at or below this batch size the handful of per-step update kernels cost more in
+    # launch latency than one small D2H copy, so the tracking state lives on the CPU
+    CPU_TRACKING_MAX_BATCH_SIZE = 32
+
     def __init__(self, model: Any, context_lengths: torch.Tensor, max_length: int):
         super().__init__(model)
+        batch_size = len(context_lengths)
         self._context_lengths = context_lengths
         self._max_length = max_length
-        self._end_idx = torch.full_like(context_lengths, fill_value=-1)
+        self._device = context_lengths.device
+
+        self._cpu_tracking = context_lengths.is_cuda and batch_size <= self.CPU_TRACKING_MAX_BATCH_SIZE
+        if self._cpu_tracking:
+            self._track_lengths = context_lengths.cpu()
+            # pinned staging buffers for the per-step D2H copy of `is_end` and the final
+            # H2D copy of the lengths
+            self._is_end_buf = torch.empty(batch_size, dtype=torch.bool, pin_memory=True)
+            self._lengths_buf = torch.empty((batch_size, 1), dtype=torch.int64, pin_memory=True)
+        else:
+            self._track_lengths = context_lengths
+            self._is_end_buf = None
+            self._lengths_buf = torch.empty((batch_size, 1), dtype=torch.int64, device=self._device)
+
+        # `get_lengths` may be called repeatedly, so keep its inputs/outputs preallocated
+        # and in int64 from the start instead of allocating + casting on every call
+        track_device = self._track_lengths.device
+        self._end_idx = torch.full((batch_size,), -1, dtype=torch.int64, device=track_device)
+        self._max_total_lengths = (self._track_lengths + max_length).to(torch.int64)
+        self._mask_buf = torch.empty(batch_size, dtype=torch.bool, device=track_device)
+        # once decoding passes the longest prompt the started mask is all-True forever,
+        # so remember the threshold and stop computing the comparison past it
+        self._max_context_length = int(context_lengths.max())
+        self._all_started = False
+        self._pp_size = parallel_state.get_pipeline_model_parallel_world_size()
 
     def end_of_generation_condition(
         self, tokens: torch.Tensor, prev: torch.Tensor, eod_id: int, end_strings: List[str]
     ) -> torch.Tensor:
         is_end = super().end_of_generation_condition(tokens=tokens, prev=prev, eod_id=eod_id, end_strings=end_strings)
-        assert len(is_end) == len(tokens)
-        if len(tokens) != len(self._context_lengths):
-            raise RuntimeError(
-                "Batch size mismatch: the `context_lengths` tensor provided in the constructor has batch size "
-                f"{len(self._context_lengths)}, while the generated tokens have batch size {len(tokens)}"
-            )
+        if __debug__:
+            # these invariants cannot change between steps, so the checks run per generated
+            # token only under the default interpreter and are stripped with `python -O`
+            assert len(is_end) == len(tokens)
+            if len(tokens) != len(self._context_lengths):
+                raise RuntimeError(
+                    "Batch size mismatch: the `context_lengths` tensor provided in the constructor has batch size "
+                    f"{len(self._context_lengths)}, while the generated tokens have batch size {len(tokens)}"
+                )
         context_length = tokens.size(1) - 1  # the input tokens come from `tokens[:, : context_length + 1]`
-        started = self._context_lengths <= context_length
         # The generation ends right now when three conditions hold:
         #   - it has started
         #   - the end generation is triggered now
         #   - it did *not* end before
-        self._end_idx = torch.where(started & is_end & (self._end_idx < 0), context_length, self._end_idx)
+        # NOTE: this runs per generated token, so the conditions are chained in place
+        # through a preallocated buffer rather than allocating fresh tensors every step
+        if self._cpu_tracking:
+            # stage `is_end` through pinned memory; the sync makes the copy visible
+            # before the CPU-side update below reads it
+            self._is_end_buf.copy_(is_end, non_blocking=True)
+            torch.cuda.current_stream().synchronize()
+            is_end_tracked = self._is_end_buf
+        else:
+            is_end_tracked = is_end
+        torch.lt(self._end_idx, 0, out=self._mask_buf)
+        self._mask_buf &= is_end_tracked
+        if not self._all_started:
+            self._mask_buf &= self._track_lengths <= context_length
+            self._all_started = context_length >= self._max_context_length
+        self._end_idx.masked_fill_(self._mask_buf, context_length)
         return is_end
 
     def get_lengths(self) -> torch.Tensor:
@@ -68,32 +133,154 @@ class TrackLengthGPTModelTextGenerationStrategy(GPTModelTextGenerationStrategy):
         """
         lengths = None
         if parallel_state.is_pipeline_last_stage():  # only the last stage actually has access to lengths
-            lengths = torch.where(self._end_idx >= 0, self._end_idx + 1, self._context_lengths + self._max_length)
-            lengths = lengths.to(torch.int64).view((-1, 1))
-        lengths = broadcast_2d_tensor_within_pp(lengths, dtype=torch.int64)
+            torch.where(self._end_idx >= 0, self._end_idx + 1, self._max_total_lengths, out=self._lengths_buf.view(-1))
+            lengths = self._lengths_buf
+            if self._cpu_tracking:
+                lengths = lengths.to(self._device, non_blocking=True)
+        if self._pp_size > 1:
+            lengths = broadcast_2d_tensor_within_pp(lengths, dtype=torch.int64)
         return lengths.flatten()
 
 
-def tokenize_batch(sentences, tokenizer, max_len, add_BOS=False, add_EOS=False):
-    """convert the sentences into lists of tokens, pad them to the same length, add bos tokens if it is needed
+# sharded tokenization only pays off once the batch is big enough to amortize
+# the per-thread tokenizer clones
+TOKENIZE_SHARD_MIN_BATCH = 2048
+
+# below this batch size the flat-array conversion costs more than the parallel fill saves
+NUMBA_PAD_MIN_BATCH = 256
+
+if HAVE_NUMBA:
+
+    @njit(parallel=True)
+    def _pad_batch_fill(values, offsets, pad_id, out):
+        """fill the padded matrix row-parallel from a flat values + offsets (CSR-like) layout"""
+        for i in prange(offsets.size - 1):
+            start, end = offsets[i], offsets[i + 1]
+            out[i, : end - start] = values[start:end]
+            out[i, end - start :] = pad_id
+
+
+def _tokenize_batch_sharded(backend, sentences, num_shards):
+    """tokenize `sentences` in parallel shards, each shard with its own tokenizer clone
+
+    HF fast tokenizers serialize large batches on an internal lock, so on many-core
+    hosts very large prompt lists tokenize faster when split across a few threads.
+    The clones are deep copies; their cost is amortized over the (large) shard they
+    each process.
+    """
+    shard_size = math.ceil(len(sentences) / num_shards)
+    shards = [sentences[i : i + shard_size] for i in range(0, len(sentences), shard_size)]
+    backends = [backend] + [copy.deepcopy(backend) for _ in range(len(shards) - 1)]
+
+    def tokenize_shard(args):
+        shard, shard_backend = args
+        return shard_backend(shard, add_special_tokens=False)["input_ids"]
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        shard_ids = pool.map(tokenize_shard, zip(shards, backends))
+
+    return [ids for shard in shard_ids for ids in shard]
+
+
+@functools.lru_cache(maxsize=8)
+def get_cached_tokenizer(pretrained_model_name: str):
+    """get a tokenizer by name, constructing it at most once per process
+
+    Building an HF-backed tokenizer can cost tens of milliseconds, so callers that
+    prepare prompts batch by batch (e.g. through `tokenize_batch`) should resolve
+    their tokenizer through this helper instead of re-instantiating it per batch.
+    """
+    return AutoTokenizer(pretrained_model_name)
+
+
+def pad_batch(batch, pad_id, max_len):
+    """pad the token lists in `batch` to the longest sequence plus `max_len` extra positions
+
+    Vectorized replacement for NeMo's `pad_batch`: the padding is written into a single
+    preallocated array instead of extending every list element by element, and the
+    caller's token lists are left untouched.
+
+    Returns the padded tokens as an int64 array of shape [batch, padded_length] along
+    with the original sequence lengths.
     """
+    context_lengths = np.fromiter((len(tokens) for tokens in batch), dtype=np.int64, count=len(batch))
+    padded_length = int(context_lengths.max()) + max(max_len, 0)
 
-    def tokenize(sentence):
-        output = tokenizer.text_to_ids(sentence)
+    if HAVE_NUMBA and len(batch) >= NUMBA_PAD_MIN_BATCH:
+        values = np.fromiter(
+            itertools.chain.from_iterable(batch), dtype=np.int64, count=int(context_lengths.sum())
+        )
+        offsets = np.zeros(len(batch) + 1, dtype=np.int64)
+        np.cumsum(context_lengths, out=offsets[1:])
 
-        if add_BOS:
-            output = [tokenizer.bos_id] + output
+        padded_tokens = np.empty((len(batch), padded_length), dtype=np.int64)
+        _pad_batch_fill(values, offsets, pad_id, padded_tokens)
+    else:
+        padded_tokens = np.full((len(batch), padded_length), pad_id, dtype=np.int64)
+        for i, tokens in enumerate(batch):
+            padded_tokens[i, : len(tokens)] = tokens
 
-        if add_EOS:
-            output.append(tokenizer.eos_id)
+    return padded_tokens, context_lengths
 
-        return output
 
-    context_tokens = list(map(tokenize, sentences))
+def tokenize_batch(sentences, tokenizer, max_len, add_BOS=False, add_EOS=False):
+    """convert the sentences into lists of tokens, pad them to the same length, add bos tokens if it is needed
+    """
+    # HF-backed tokenizers are much faster when called once on the whole batch, since that
+    # crosses into the Rust backend a single time and lets it parallelize internally
+    backend = getattr(tokenizer, "tokenizer", None)
+    if backend is not None and hasattr(backend, "batch_encode_plus"):
+        sentences = list(sentences)
+        # opt-in sharding across threads for very large prompt lists
+        num_shards = int(os.environ.get("NEMO_ALIGNER_TOKENIZE_SHARDS", "0"))
+        if num_shards > 1 and len(sentences) >= TOKENIZE_SHARD_MIN_BATCH:
+            context_tokens = _tokenize_batch_sharded(backend, sentences, num_shards)
+        else:
+            context_tokens = backend(sentences, add_special_tokens=False)["input_ids"]
+    else:
+        context_tokens = [tokenizer.text_to_ids(sentence) for sentence in sentences]
+
+    if add_BOS:
+        context_tokens = [[tokenizer.bos_id] + tokens for tokens in context_tokens]
+
+    if add_EOS:
+        context_tokens = [tokens + [tokenizer.eos_id] for tokens in context_tokens]
     max_sequence_length = max(len(x) for x in context_tokens)
 
     context_tokens, context_lengths = pad_batch(context_tokens, tokenizer.eos_id, max_len - max_sequence_length)
-    context_tokens = [x[:max_len] for x in context_tokens]
-    context_tokens_tensor = torch.cuda.LongTensor(context_tokens)
-    context_length_tensor = torch.cuda.LongTensor(context_lengths)
+    context_tokens = context_tokens[:, :max_len]
+
+    # one vectorized check plus a single aggregate warning, rather than inspecting
+    # (and potentially logging) every sentence on its own
+    num_exceeded = int((context_lengths > max_len).sum())
+    if num_exceeded > 0:
+        logging.warning(
+            f"{num_exceeded} of {len(context_lengths)} sequences exceeded {max_len=} and were truncated"
+        )
+    # stage through pinned host memory so the H2D copies run async on the current
+    # stream instead of blocking, downstream kernels order after them automatically
+    device = torch.cuda.current_device()
+    context_tokens_tensor = torch.from_numpy(context_tokens).pin_memory().to(device, non_blocking=True)
+    context_length_tensor = torch.from_numpy(context_lengths).pin_memory().to(device, non_blocking=True)
     return context_tokens_tensor, context_length_tensor
+
+
+def tokenize_batches_iter(sentences_iter, tokenizer, max_len, add_BOS=False, add_EOS=False):
+    """run `tokenize_batch` one batch ahead of the consumer
+
+    Tokenization is CPU-bound (the HF backend releases the GIL) while generation is
+    GPU-bound, so while the caller generates with batch N a background thread already
+    tokenizes batch N + 1, hiding most of the prompt preparation cost.
+
+    Yields the same (tokens, lengths) tuples as `tokenize_batch`.
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = None
+        for sentences in sentences_iter:
+            next_future = pool.submit(tokenize_batch, sentences, tokenizer, max_len, add_BOS, add_EOS)
+            if future is not None:
+                yield future.result()
+            future = next_future
+
+        if future is not None:
+            yield future.result()
@@ -17,7 +17,12 @@ import math
 import torch
 import torch.nn.functional as F
 
-from nemo_aligner.utils.ppo_utils import calculate_advantages_and_returns, calculate_entropy, calculate_ppo_rewards
+from nemo_aligner.utils.ppo_utils import (
+    calculate_advantages_and_returns,
+    calculate_entropy,
+    calculate_ppo_rewards,
+    create_mask,
+)
 
 
 class TestCalculateEntropy:
@@ -107,6 +112,32 @@ class TestCalculatePPORewards:
         ), "ppo_rewards on is not aligned with the init policy kl on positions where rewards is 0"
 
 
+class TestCreateMask:
+    def test_create_mask_small_example(self):
+        values = torch.zeros(2, 6, dtype=torch.float32)
+        prompt_lengths = torch.as_tensor([2, 3], dtype=torch.long)
+        response_lengths = torch.as_tensor([5, 6], dtype=torch.long)
+
+        mask = create_mask(values, prompt_lengths, response_lengths)
+
+        # keep everything between prompt_length - 1 and response_length - 1
+        gt_mask = torch.as_tensor([[0, 1, 1, 1, 0, 0], [0, 0, 1, 1, 1, 0]], dtype=torch.float32)
+        assert torch.equal(mask, gt_mask), f"expected mask to be {gt_mask} but got {mask}"
+
+    def test_create_mask_matches_per_row_slicing(self):
+        values = torch.zeros(4, 32, dtype=torch.float32)
+        prompt_lengths = torch.randint(low=1, high=16, size=(4,), dtype=torch.long)
+        response_lengths = prompt_lengths + torch.randint(low=1, high=16, size=(4,), dtype=torch.long)
+
+        mask = create_mask(values, prompt_lengths, response_lengths)
+
+        gt_mask = torch.zeros_like(values)
+        for i in range(gt_mask.size(0)):
+            gt_mask[i, prompt_lengths[i] - 1 : response_lengths[i] - 1] = 1.0
+
+        assert torch.equal(mask, gt_mask), "vectorized mask does not match the per-row slicing reference"
+
+
 class TestCalculateAdvantagesAndReturns:
     def test_calculate_advantage_and_returns_small_example(self):
         gae_lambda = 0
@@ -0,0 +1,68 @@
+# Copyright (c) 2023, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+import numpy as np
+import pytest
+
+from nemo_aligner.utils.text_generation_utils import HAVE_NUMBA, NUMBA_PAD_MIN_BATCH, pad_batch
+
+
+class TestPadBatch:
+    def test_pad_batch_pads_to_longest_plus_extra(self):
+        pad_id = 99999
+        batch = [[1, 2, 3], [4, 5]]
+
+        padded_tokens, context_lengths = pad_batch(batch, pad_id, 2)
+
+        gt_tokens = np.asarray([[1, 2, 3, pad_id, pad_id], [4, 5, pad_id, pad_id, pad_id]], dtype=np.int64)
+        assert np.array_equal(padded_tokens, gt_tokens), f"expected padded tokens {gt_tokens} but got {padded_tokens}"
+        assert context_lengths.tolist() == [3, 2], f"expected lengths [3, 2] but got {context_lengths.tolist()}"
+
+    def test_pad_batch_negative_extra_pads_to_longest(self):
+        pad_id = 0
+        batch = [[1, 2, 3, 4], [5]]
+
+        padded_tokens, _ = pad_batch(batch, pad_id, -2)
+
+        # a negative extra length must not shrink the batch below the longest sequence
+        assert padded_tokens.shape == (2, 4), f"expected shape (2, 4) but got {padded_tokens.shape}"
+
+    @pytest.mark.skipif(not HAVE_NUMBA, reason="numba is not installed")
+    def test_pad_batch_numba_path_matches_slice_assignment(self):
+        pad_id = 99999
+        rng = np.random.default_rng(0)
+        # large enough to take the parallel Numba fill path instead of the NumPy fallback
+        lengths = rng.integers(low=1, high=20, size=NUMBA_PAD_MIN_BATCH)
+        batch = [rng.integers(low=0, high=1000, size=length).tolist() for length in lengths]
+
+        padded_tokens, context_lengths = pad_batch(batch, pad_id, 3)
+
+        gt_tokens = np.full((len(batch), int(lengths.max()) + 3), pad_id, dtype=np.int64)
+        for i, tokens in enumerate(batch):
+            gt_tokens[i, : len(tokens)] = tokens
+
+        assert np.array_equal(
+            padded_tokens, gt_tokens
+        ), "numba fill path does not match the slice-assignment reference"
+        assert context_lengths.tolist() == lengths.tolist(), "lengths from the numba path do not match the inputs"
+
+    def test_pad_batch_does_not_mutate_inputs(self):
+        batch = [[1, 2, 3], [4, 5]]
+        batch_before = copy.deepcopy(batch)
+
+        pad_batch(batch, 99999, 4)
+
+        assert batch == batch_before, "pad_batch must not mutate the caller's token lists"